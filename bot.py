@@ -1,5 +1,6 @@
 import os
 import json
+import functools
 import logging
 import asyncio
 from datetime import datetime
@@ -15,6 +16,7 @@ from io import TextIOWrapper, BytesIO
 from PIL import Image, ImageDraw, ImageFont
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(
@@ -116,6 +118,9 @@ WATERMARK_TEXT = os.getenv('WATERMARK_TEXT', 'TEST_WATERMARK')
 MAX_SUGGESTIONS_PER_DAY = 20
 SUGGESTION_COOLDOWN_SECONDS = 2
 
+# Watermarking settings
+WATERMARK_MAX_WORKERS = 2  # Concurrent watermark jobs (CPU-bound, run off the event loop)
+
 MAIN_ADMIN_COMMANDS = [
     BotCommand(command="add_admin", description="Add new administrator"),
     BotCommand(command="remove_admin", description="Remove administrator"),
@@ -355,8 +360,45 @@ class UserLimitsManager:
         return result
 
 
-async def add_watermark_to_bytes(image_bytes, watermark_text, opacity=50, text_width_ratio=0.33, shadow_offset=3,
-                                 shadow_opacity=40):
+# Available fonts (Ubuntu paths first, then macOS for local testing)
+FONT_PATHS = [
+    # Ubuntu/Debian - Liberation fonts (usually pre-installed)
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    # Ubuntu/Debian - DejaVu fonts (common fallback)
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    # Ubuntu - Ubuntu font family
+    '/usr/share/fonts/truetype/ubuntu/Ubuntu-B.ttf',
+    '/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf',
+    # macOS (for local development/testing)
+    '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
+    '/System/Library/Fonts/Supplemental/Arial.ttf',
+]
+
+
+@functools.lru_cache(maxsize=1)
+def _resolve_font_path() -> Optional[str]:
+    """Find the first available font path (probed once per process)"""
+    for font_path in FONT_PATHS:
+        if os.path.exists(font_path):
+            logger.info(f"Found available font: {font_path}")
+            return font_path
+        logger.debug(f"Font not available: {font_path}")
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _get_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Load a TrueType font, cached by (path, size)"""
+    return ImageFont.truetype(path, size)
+
+
+# Dedicated bounded pool for watermarking, kept separate from the default executor
+watermark_executor = ThreadPoolExecutor(max_workers=WATERMARK_MAX_WORKERS, thread_name_prefix='watermark')
+
+
+async def add_watermark_to_bytes(image_bytes, watermark_text, opacity=50, text_width_ratio=0.33, shadow_opacity=40):
     """
     Async function to add watermark to image bytes and return result as bytes.
 
@@ -365,22 +407,20 @@ async def add_watermark_to_bytes(image_bytes, watermark_text, opacity=50, text_w
         watermark_text (str): Text to use as watermark
         opacity (int): Opacity of main text (0-255)
         text_width_ratio (float): Width of text relative to image width
-        shadow_offset (int): Shadow offset in pixels
-        shadow_opacity (int): Shadow opacity (0-255)
+        shadow_opacity (int): Outline opacity (0-255), the outline doubles as the shadow
 
     Returns:
         BytesIO: Watermarked image as BytesIO object
     """
     try:
         # Run PIL operations in a thread pool since they're CPU-bound
-        return await asyncio.get_event_loop().run_in_executor(
-            None,
+        return await asyncio.get_running_loop().run_in_executor(
+            watermark_executor,
             process_image,
             image_bytes,
             watermark_text,
             opacity,
             text_width_ratio,
-            shadow_offset,
             shadow_opacity
         )
     except Exception as e:
@@ -388,102 +428,55 @@ async def add_watermark_to_bytes(image_bytes, watermark_text, opacity=50, text_w
         raise e
 
 
-def process_image(image_bytes, watermark_text, opacity, text_width_ratio, shadow_offset, shadow_opacity):
+def process_image(image_bytes, watermark_text, opacity, text_width_ratio, shadow_opacity):
     """
     Synchronous image processing function to be run in thread pool
     """
     # Open image from bytes
     img = Image.open(BytesIO(image_bytes))
 
-    # Create copies to work with
-    img_copy = img.copy()
-    if img_copy.mode != 'RGBA':
-        img_copy = img_copy.convert('RGBA')
-
-    # Create a transparent overlay for watermark
-    watermark = Image.new('RGBA', img_copy.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(watermark)
-
-    # Available fonts (Ubuntu paths first, then macOS for local testing)
-    font_paths = [
-        # Ubuntu/Debian - Liberation fonts (usually pre-installed)
-        '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
-        '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
-        # Ubuntu/Debian - DejaVu fonts (common fallback)
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-        # Ubuntu - Ubuntu font family
-        '/usr/share/fonts/truetype/ubuntu/Ubuntu-B.ttf',
-        '/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf',
-        # macOS (for local development/testing)
-        '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
-        '/System/Library/Fonts/Supplemental/Arial.ttf',
-    ]
+    # Create an RGBA copy to work with (convert() already returns a new image)
+    img_copy = img.convert('RGBA') if img.mode != 'RGBA' else img.copy()
 
     # Find first available font path
-    available_font_path = None
-    for font_path in font_paths:
-        try:
-            test_font = ImageFont.truetype(font_path, size=20)
-            available_font_path = font_path
-            logger.info(f"Found available font: {font_path}")
-            break
-        except Exception as e:
-            logger.debug(f"Font not available {font_path}: {str(e)}")
-            continue
+    available_font_path = _resolve_font_path()
 
     # Calculate target text width based on ratio
     target_text_width = img_copy.width * text_width_ratio
     logger.info(f"Target text width: {target_text_width}px (ratio: {text_width_ratio})")
 
-    # Calculate optimal font size using binary search
-    if available_font_path:
-        min_size = 10
-        max_size = int(img_copy.height * 0.4)  # Max 40% of image height
-        best_font_size = min_size
-        best_font = None
-
-        # Binary search for optimal font size
-        for iteration in range(20):  # Max 20 iterations
-            current_size = (min_size + max_size) // 2
-
-            try:
-                test_font = ImageFont.truetype(available_font_path, size=current_size)
-                bbox = draw.textbbox((0, 0), watermark_text, font=test_font)
-                current_text_width = bbox[2] - bbox[0]
-
-                # Within 3% of target is acceptable
-                if abs(current_text_width - target_text_width) < target_text_width * 0.03:
-                    best_font_size = current_size
-                    best_font = test_font
-                    logger.info(f"Found optimal font size: {current_size}px after {iteration + 1} iterations")
-                    break
-
-                if current_text_width < target_text_width:
-                    min_size = current_size + 1
-                    best_font_size = current_size
-                    best_font = test_font
-                else:
-                    max_size = current_size - 1
-
-            except Exception as e:
-                logger.error(f"Error during font size calculation: {e}")
-                break
-
-        if best_font is None:
-            best_font = ImageFont.truetype(available_font_path, size=best_font_size)
-
-        font = best_font
-        base_font_size = best_font_size
+    # Scratch surface for measuring text the same way draw.text lays it out
+    # (font.getbbox treats multiline text as a single line)
+    measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
 
-    else:
+    # Calculate optimal font size from a single reference measurement
+    # (glyph advance widths scale linearly with font size)
+    font = None
+    if available_font_path:
+        try:
+            ref_size = 100
+            ref_font = _get_font(available_font_path, ref_size)
+            ref_bbox = measure_draw.textbbox((0, 0), watermark_text, font=ref_font)
+            ref_text_width = max(1, ref_bbox[2] - ref_bbox[0])
+
+            min_size = 10
+            max_size = int(img_copy.height * 0.4)  # Max 40% of image height
+            best_font_size = max(min_size, min(max_size, round(ref_size * target_text_width / ref_text_width)))
+            logger.info(f"Calculated font size: {best_font_size}px")
+
+            font = _get_font(available_font_path, best_font_size)
+            base_font_size = best_font_size
+        except OSError as e:
+            logger.error(f"Error loading font {available_font_path}: {e}")
+
+    if font is None:
         # Fallback: use larger multiplier if no TrueType font available
-        logger.warning("No TrueType fonts found, using default font")
+        logger.warning("No usable TrueType font found, using default font")
         font = ImageFont.load_default()
         base_font_size = 11  # Default font size
 
     # Get final text dimensions
-    bbox = draw.textbbox((0, 0), watermark_text, font=font)
+    bbox = measure_draw.textbbox((0, 0), watermark_text, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
 
@@ -506,32 +499,32 @@ def process_image(image_bytes, watermark_text, opacity, text_width_ratio, shadow
     logger.info(f"Watermark position: ({x}, {y})")
 
     # Calculate stroke width for better visibility
-    stroke_width = max(2, base_font_size // 15)
-
-    # Draw the shadow (larger offset for better visibility)
-    shadow_offset_scaled = max(shadow_offset, base_font_size // 20)
-    draw.text(
-        (x + shadow_offset_scaled, y + shadow_offset_scaled),
-        watermark_text,
-        font=font,
-        fill=(0, 0, 0, shadow_opacity)
-    )
+    # (the outline doubles as the shadow, so the text is rasterized only once)
+    stroke_width = max(3, base_font_size // 12)
+
+    # Create a transparent overlay covering only the watermark region
+    stroke_bbox = measure_draw.textbbox((0, 0), watermark_text, font=font, stroke_width=stroke_width)
+    overlay_x = max(0, x + stroke_bbox[0])
+    overlay_y = max(0, y + stroke_bbox[1])
+    overlay_size = (x + stroke_bbox[2] - overlay_x, y + stroke_bbox[3] - overlay_y)
+    watermark = Image.new('RGBA', overlay_size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(watermark)
 
     # Draw the main text with stroke/outline for better visibility
     draw.text(
-        (x, y),
+        (x - overlay_x, y - overlay_y),
         watermark_text,
         font=font,
         fill=(255, 255, 255, opacity),
         stroke_width=stroke_width,
-        stroke_fill=(0, 0, 0, min(255, shadow_opacity + 40))
+        stroke_fill=(0, 0, 0, min(255, shadow_opacity + 80))
     )
 
-    # Combine the original image with the watermark
-    watermarked = Image.alpha_composite(img_copy, watermark)
+    # Composite the watermark in place, touching only the overlay region
+    img_copy.alpha_composite(watermark, dest=(overlay_x, overlay_y))
 
     # Convert back to RGB
-    watermarked = watermarked.convert('RGB')
+    watermarked = img_copy.convert('RGB')
 
     # Save to BytesIO object with high quality
     output = BytesIO()
@@ -725,7 +718,6 @@ async def process_suggestion_action(callback_query: types.CallbackQuery):
                             watermark_text=WATERMARK_TEXT,
                             opacity=128,
                             text_width_ratio=0.33,
-                            shadow_offset=3,
                             shadow_opacity=40
                         )
 
@@ -1401,7 +1393,6 @@ async def handle_complete_admin_media_group(media_group_id: str):
                         watermark_text=WATERMARK_TEXT,
                         opacity=128,
                         text_width_ratio=0.33,
-                        shadow_offset=3,
                         shadow_opacity=40
                     )
 
@@ -1585,7 +1576,6 @@ async def handle_admin_message(message: Message):
                     watermark_text=WATERMARK_TEXT,
                     opacity=128,
                     text_width_ratio=0.33,
-                    shadow_offset=3,
                     shadow_opacity=40
                 )
 
@@ -1765,6 +1755,8 @@ async def main():
 
     except Exception as e:
         logger.error(f"Error in main: {e}")
+    finally:
+        watermark_executor.shutdown(wait=True)
 
 
 if __name__ == '__main__':
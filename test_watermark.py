@@ -1,4 +1,5 @@
 import os
+import functools
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 import random
@@ -13,101 +14,95 @@ OUTPUT_DIR = "watermark_examples"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
-def process_image_improved(image_bytes, watermark_text, opacity, text_width_ratio, shadow_offset, shadow_opacity):
+# Available fonts (Ubuntu paths first, then macOS for local testing)
+FONT_PATHS = [
+    # Ubuntu/Debian - Liberation fonts (usually pre-installed)
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    # Ubuntu/Debian - DejaVu fonts (common fallback)
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    # Ubuntu - Ubuntu font family
+    '/usr/share/fonts/truetype/ubuntu/Ubuntu-B.ttf',
+    '/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf',
+    # macOS (for local development/testing)
+    '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
+    '/System/Library/Fonts/Supplemental/Arial.ttf',
+]
+
+
+@functools.lru_cache(maxsize=1)
+def _resolve_font_path():
+    """Find the first available font path (probed once per process)"""
+    for font_path in FONT_PATHS:
+        if os.path.exists(font_path):
+            print(f"Found available font: {font_path}")
+            return font_path
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _get_font(path, size):
+    """Load a TrueType font, cached by (path, size)"""
+    return ImageFont.truetype(path, size)
+
+
+def process_image_improved(image_bytes, watermark_text, opacity, text_width_ratio, shadow_opacity):
     """
     Improved watermark processing function (same as in bot.py)
     """
     # Open image from bytes
     img = Image.open(BytesIO(image_bytes))
 
-    # Create copies to work with
-    img_copy = img.copy()
-    if img_copy.mode != 'RGBA':
-        img_copy = img_copy.convert('RGBA')
+    return watermark_image_improved(img, watermark_text, opacity, text_width_ratio, shadow_opacity)
 
-    # Create a transparent overlay for watermark
-    watermark = Image.new('RGBA', img_copy.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(watermark)
 
-    # Available fonts (Ubuntu paths first, then macOS for local testing)
-    font_paths = [
-        # Ubuntu/Debian - Liberation fonts (usually pre-installed)
-        '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
-        '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
-        # Ubuntu/Debian - DejaVu fonts (common fallback)
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-        # Ubuntu - Ubuntu font family
-        '/usr/share/fonts/truetype/ubuntu/Ubuntu-B.ttf',
-        '/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf',
-        # macOS (for local development/testing)
-        '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
-        '/System/Library/Fonts/Supplemental/Arial.ttf',
-    ]
+def watermark_image_improved(img, watermark_text, opacity, text_width_ratio, shadow_opacity):
+    """
+    Apply the improved watermark to an already opened image
+    """
+    # Create an RGBA copy to work with (convert() already returns a new image)
+    img_copy = img.convert('RGBA') if img.mode != 'RGBA' else img.copy()
 
     # Find first available font path
-    available_font_path = None
-    for font_path in font_paths:
-        try:
-            test_font = ImageFont.truetype(font_path, size=20)
-            available_font_path = font_path
-            print(f"Found available font: {font_path}")
-            break
-        except Exception as e:
-            continue
+    available_font_path = _resolve_font_path()
 
     # Calculate target text width based on ratio
     target_text_width = img_copy.width * text_width_ratio
     print(f"Target text width: {target_text_width}px (ratio: {text_width_ratio})")
 
-    # Calculate optimal font size using binary search
+    # Scratch surface for measuring text the same way draw.text lays it out
+    # (font.getbbox treats multiline text as a single line)
+    measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+
+    # Calculate optimal font size from a single reference measurement
+    # (glyph advance widths scale linearly with font size)
+    font = None
     if available_font_path:
-        min_size = 10
-        max_size = int(img_copy.height * 0.4)  # Max 40% of image height
-        best_font_size = min_size
-        best_font = None
-
-        # Binary search for optimal font size
-        for iteration in range(20):  # Max 20 iterations
-            current_size = (min_size + max_size) // 2
-
-            try:
-                test_font = ImageFont.truetype(available_font_path, size=current_size)
-                bbox = draw.textbbox((0, 0), watermark_text, font=test_font)
-                current_text_width = bbox[2] - bbox[0]
-
-                # Within 3% of target is acceptable
-                if abs(current_text_width - target_text_width) < target_text_width * 0.03:
-                    best_font_size = current_size
-                    best_font = test_font
-                    print(f"Found optimal font size: {current_size}px after {iteration + 1} iterations")
-                    break
-
-                if current_text_width < target_text_width:
-                    min_size = current_size + 1
-                    best_font_size = current_size
-                    best_font = test_font
-                else:
-                    max_size = current_size - 1
-
-            except Exception as e:
-                print(f"Error during font size calculation: {e}")
-                break
-
-        if best_font is None:
-            best_font = ImageFont.truetype(available_font_path, size=best_font_size)
-
-        font = best_font
-        base_font_size = best_font_size
-
-    else:
+        try:
+            ref_size = 100
+            ref_font = _get_font(available_font_path, ref_size)
+            ref_bbox = measure_draw.textbbox((0, 0), watermark_text, font=ref_font)
+            ref_text_width = max(1, ref_bbox[2] - ref_bbox[0])
+
+            min_size = 10
+            max_size = int(img_copy.height * 0.4)  # Max 40% of image height
+            best_font_size = max(min_size, min(max_size, round(ref_size * target_text_width / ref_text_width)))
+            print(f"Calculated font size: {best_font_size}px")
+
+            font = _get_font(available_font_path, best_font_size)
+            base_font_size = best_font_size
+        except OSError as e:
+            print(f"Error loading font {available_font_path}: {e}")
+
+    if font is None:
         # Fallback: use larger multiplier if no TrueType font available
-        print("No TrueType fonts found, using default font")
+        print("No usable TrueType font found, using default font")
         font = ImageFont.load_default()
         base_font_size = 11  # Default font size
 
     # Get final text dimensions
-    bbox = draw.textbbox((0, 0), watermark_text, font=font)
+    bbox = measure_draw.textbbox((0, 0), watermark_text, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
 
@@ -130,32 +125,32 @@ def process_image_improved(image_bytes, watermark_text, opacity, text_width_rati
     print(f"Watermark position: ({x}, {y})")
 
     # Calculate stroke width for better visibility
-    stroke_width = max(2, base_font_size // 15)
-
-    # Draw the shadow (larger offset for better visibility)
-    shadow_offset_scaled = max(shadow_offset, base_font_size // 20)
-    draw.text(
-        (x + shadow_offset_scaled, y + shadow_offset_scaled),
-        watermark_text,
-        font=font,
-        fill=(0, 0, 0, shadow_opacity)
-    )
+    # (the outline doubles as the shadow, so the text is rasterized only once)
+    stroke_width = max(3, base_font_size // 12)
+
+    # Create a transparent overlay covering only the watermark region
+    stroke_bbox = measure_draw.textbbox((0, 0), watermark_text, font=font, stroke_width=stroke_width)
+    overlay_x = max(0, x + stroke_bbox[0])
+    overlay_y = max(0, y + stroke_bbox[1])
+    overlay_size = (x + stroke_bbox[2] - overlay_x, y + stroke_bbox[3] - overlay_y)
+    watermark = Image.new('RGBA', overlay_size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(watermark)
 
     # Draw the main text with stroke/outline for better visibility
     draw.text(
-        (x, y),
+        (x - overlay_x, y - overlay_y),
         watermark_text,
         font=font,
         fill=(255, 255, 255, opacity),
         stroke_width=stroke_width,
-        stroke_fill=(0, 0, 0, min(255, shadow_opacity + 40))
+        stroke_fill=(0, 0, 0, min(255, shadow_opacity + 80))
     )
 
-    # Combine the original image with the watermark
-    watermarked = Image.alpha_composite(img_copy, watermark)
+    # Composite the watermark in place, touching only the overlay region
+    img_copy.alpha_composite(watermark, dest=(overlay_x, overlay_y))
 
     # Convert back to RGB
-    watermarked = watermarked.convert('RGB')
+    watermarked = img_copy.convert('RGB')
 
     return watermarked
 
@@ -167,10 +162,15 @@ def process_image_old(image_bytes, watermark_text, opacity, text_width_ratio, sh
     # Open image from bytes
     img = Image.open(BytesIO(image_bytes))
 
-    # Create copies to work with
-    img_copy = img.copy()
-    if img_copy.mode != 'RGBA':
-        img_copy = img_copy.convert('RGBA')
+    return watermark_image_old(img, watermark_text, opacity, text_width_ratio, shadow_offset, shadow_opacity)
+
+
+def watermark_image_old(img, watermark_text, opacity, text_width_ratio, shadow_offset, shadow_opacity):
+    """
+    Apply the old watermark to an already opened image
+    """
+    # Create an RGBA copy to work with (convert() already returns a new image)
+    img_copy = img.convert('RGBA') if img.mode != 'RGBA' else img.copy()
 
     # Create a transparent overlay for watermark
     watermark = Image.new('RGBA', img_copy.size, (0, 0, 0, 0))
@@ -180,30 +180,15 @@ def process_image_old(image_bytes, watermark_text, opacity, text_width_ratio, sh
     base_font_size = int(min(img_copy.width, img_copy.height) / 15)
     print(f"OLD - Base font size: {base_font_size}")
 
-    # Available fonts (Ubuntu paths first, then macOS for local testing)
-    font_paths = [
-        # Ubuntu/Debian - Liberation fonts (usually pre-installed)
-        '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
-        '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
-        # Ubuntu/Debian - DejaVu fonts (common fallback)
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-        # Ubuntu - Ubuntu font family
-        '/usr/share/fonts/truetype/ubuntu/Ubuntu-B.ttf',
-        '/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf',
-        # macOS (for local development/testing)
-        '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
-        '/System/Library/Fonts/Supplemental/Arial.ttf',
-    ]
-
     # Find first available font with proper size
     font = None
-    for font_path in font_paths:
+    font_path = _resolve_font_path()
+    if font_path:
         try:
-            font = ImageFont.truetype(font_path, size=base_font_size)
-            break
-        except Exception:
-            continue
+            font = _get_font(font_path, base_font_size)
+        except (OSError, ValueError):
+            # Unreadable font file or zero font size on tiny images
+            font = None
 
     if font is None:
         font = ImageFont.load_default()
@@ -250,15 +235,15 @@ def process_image_old(image_bytes, watermark_text, opacity, text_width_ratio, sh
 
 def create_sample_image(width, height, text):
     """Create a sample image with gradient background"""
-    img = Image.new('RGB', (width, height))
-    draw = ImageDraw.Draw(img)
-
-    # Create a gradient
+    # Create a gradient as a single 1px-wide column, then stretch it horizontally
+    column = bytearray()
     for y in range(height):
         r = int(100 + (155 * y / height))
         g = int(150 - (50 * y / height))
         b = int(200 - (100 * y / height))
-        draw.rectangle([(0, y), (width, y+1)], fill=(r, g, b))
+        column += bytes((r, g, b))
+    img = Image.frombytes('RGB', (1, height), bytes(column)).resize((width, height), Image.NEAREST)
+    draw = ImageDraw.Draw(img)
 
     # Add some text to make it look like a real image
     try:
@@ -296,28 +281,24 @@ def run_tests():
             "name": "Default Settings",
             "opacity": 128,
             "text_width_ratio": 0.33,
-            "shadow_offset": 3,
             "shadow_opacity": 40
         },
         {
             "name": "High Opacity",
             "opacity": 200,
             "text_width_ratio": 0.33,
-            "shadow_offset": 3,
             "shadow_opacity": 80
         },
         {
             "name": "Larger Text",
             "opacity": 128,
             "text_width_ratio": 0.45,
-            "shadow_offset": 4,
             "shadow_opacity": 40
         },
         {
             "name": "Smaller Text",
             "opacity": 128,
             "text_width_ratio": 0.25,
-            "shadow_offset": 2,
             "shadow_opacity": 40
         },
     ]
@@ -331,21 +312,23 @@ def run_tests():
         # Create sample image
         sample_img = create_sample_image(width, height, size_name)
 
-        # Convert to bytes
+        # Convert to JPEG bytes and decode them once for all methods/configs below
         img_bytes = BytesIO()
         sample_img.save(img_bytes, format='JPEG')
-        img_bytes.seek(0)
+        raw = img_bytes.getvalue()
+        jpeg_img = Image.open(BytesIO(raw))
+        jpeg_img.load()
 
         # Save original
         original_path = f"{OUTPUT_DIR}/{size_name.replace(' ', '_')}_0_original.jpg"
-        sample_img.save(original_path)
+        with open(original_path, 'wb') as f:
+            f.write(raw)
         print(f"Saved original: {original_path}")
 
         # Test OLD method
         print(f"\n--- OLD METHOD ---")
-        img_bytes.seek(0)
-        old_watermarked = process_image_old(
-            img_bytes.read(),
+        old_watermarked = watermark_image_old(
+            jpeg_img,
             WATERMARK_TEXT,
             opacity=128,
             text_width_ratio=0.33,
@@ -358,13 +341,11 @@ def run_tests():
 
         # Test NEW method with default config
         print(f"\n--- NEW METHOD (Default) ---")
-        img_bytes.seek(0)
-        new_watermarked = process_image_improved(
-            img_bytes.read(),
+        new_watermarked = watermark_image_improved(
+            jpeg_img,
             WATERMARK_TEXT,
             opacity=128,
             text_width_ratio=0.33,
-            shadow_offset=3,
             shadow_opacity=40
         )
         new_path = f"{OUTPUT_DIR}/{size_name.replace(' ', '_')}_2_new_default.jpg"
@@ -375,13 +356,11 @@ def run_tests():
         if "Medium" in size_name:
             for i, config in enumerate(test_configs[1:], start=3):
                 print(f"\n--- NEW METHOD ({config['name']}) ---")
-                img_bytes.seek(0)
-                variant = process_image_improved(
-                    img_bytes.read(),
+                variant = watermark_image_improved(
+                    jpeg_img,
                     WATERMARK_TEXT,
                     opacity=config['opacity'],
                     text_width_ratio=config['text_width_ratio'],
-                    shadow_offset=config['shadow_offset'],
                     shadow_opacity=config['shadow_opacity']
                 )
                 variant_path = f"{OUTPUT_DIR}/{size_name.replace(' ', '_')}_{i}_{config['name'].replace(' ', '_')}.jpg"